@@ -1,6 +1,7 @@
 import streamlit as st
 import os
 import asyncio # Importa asyncio para rodar funções assíncronas
+import contextvars
 from google import genai
 from google.adk.agents import Agent
 from google.adk.runners import Runner
@@ -13,9 +14,90 @@ import textwrap
 import warnings
 import re
 import pandas as pd
+import time
+from google.adk.events import Event
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from utilitarios import (
+    BackendCacheLocal,
+    CacheBusca,
+    CachePrefixo,
+    HistoricoHedge,
+    OrcamentoAdaptativo,
+    RegistroMetricas,
+    calcular_atraso_hedge,
+    caminho_cassete,
+    consulta_busca_pessoas_sucesso,
+    executar_com_hedge,
+    extrair_pessoas_sucesso,
+    gravar_cassete,
+    reproduzir_cassete,
+)
 
 warnings.filterwarnings("ignore")
 
+# --- Cassetes de gravação/reprodução ---
+# MODO_CASSETE controla se as chamadas aos agentes vão para o modelo ao vivo ou para o disco:
+#   "gravar"     -> chama o modelo e grava pedido, eventos (com tempos) e resposta final em cassetes
+#   "reproduzir" -> não usa a rede; serve localmente a mesma sequência de eventos gravada
+#   vazio        -> comportamento normal (somente modelo ao vivo)
+# VELOCIDADE_CASSETE acelera a reprodução (ex: 10 = dez vezes mais rápido; 0 = sem esperas)
+MODO_CASSETE = os.environ.get("MODO_CASSETE", "").strip().lower()
+PASTA_CASSETES = os.environ.get("PASTA_CASSETES", "cassetes")
+VELOCIDADE_CASSETE = float(os.environ.get("VELOCIDADE_CASSETE", "1"))
+
+# --- Cache de prefixo (instruções estáticas dos agentes) ---
+# USAR_CACHE_PREFIXO liga/desliga o cache de contexto do modelo para as instruções fixas
+# CACHE_PREFIXO_BACKEND: "gemini" (cache real na API) ou "local" (substituto que só verifica o reuso)
+# CACHE_PREFIXO_TTL: validade do cache em segundos; ele é renovado quando faltar menos que a margem
+# Desligado por padrão: as instruções atuais (~130 a 250 tokens) ficam muito abaixo do mínimo da API
+# e os modelos "-latest" não aceitam cache; só tem efeito com instruções maiores e modelos versionados.
+USAR_CACHE_PREFIXO = os.environ.get("USAR_CACHE_PREFIXO", "0") == "1"
+CACHE_PREFIXO_BACKEND = os.environ.get("CACHE_PREFIXO_BACKEND", "gemini").strip().lower()
+CACHE_PREFIXO_TTL = int(os.environ.get("CACHE_PREFIXO_TTL", "3600"))
+CACHE_PREFIXO_MARGEM = int(os.environ.get("CACHE_PREFIXO_MARGEM", "300"))
+# Tamanho mínimo de prefixo aceito pela API para cache de contexto (32.768 tokens nos modelos 1.5)
+CACHE_PREFIXO_MIN_TOKENS = int(os.environ.get("CACHE_PREFIXO_MIN_TOKENS", "32768"))
+METRICAS_MAX_REGISTROS = 5000 # Métricas mais antigas são descartadas
+
+# --- Orçamentos de geração por agente ---
+# max_tokens limita a saída do modelo; palavras_por_secao é a meta de tamanho passada no prompt
+ORCAMENTOS_AGENTES = {
+    "agente_analisador": {"max_tokens": 4096, "palavras_por_secao": 250},
+    "agente_melhorias": {"max_tokens": 3072, "palavras_por_secao": 150},
+    "agente_buscador_sucesso": {"max_tokens": 2048, "palavras_por_secao": 30}, # por pessoa da lista
+    "agente_buscador_sucesso_reserva": {"max_tokens": 2048, "palavras_por_secao": 30},
+    "agente_relatorio": {"max_tokens": 6144, "palavras_por_secao": 300},
+}
+# Modo adaptativo: reduz os orçamentos quando o p95 de latência passa do alvo e os relaxa quando sobra folga
+# (desligado com cassetes, pois a meta de palavras entra no prompt e mudaria a chave do cassete)
+ORCAMENTO_ADAPTATIVO = os.environ.get("ORCAMENTO_ADAPTATIVO", "1") != "0" and not MODO_CASSETE
+LATENCIA_ALVO_P95_S = float(os.environ.get("LATENCIA_ALVO_P95_S", "30"))
+ORCAMENTO_ESCALA_MINIMA = 0.4 # Nunca reduz abaixo de 40% do orçamento base
+ORCAMENTO_FATOR_AJUSTE = 0.8
+ORCAMENTO_CHAMADAS_ENTRE_AJUSTES = 5 # Chamadas (e amostras do p95) entre um ajuste e outro
+
+# --- Cache compartilhado do resultado da busca do Agente 3 ---
+# Guarda a lista de pessoas de sucesso já validada (a resposta do Agente 3 com google_search) sob a
+# consulta canônica da data, com TTL e limite de entradas. Num acerto o Agente 3 (e o hedge) nem é chamado.
+# O cache é compartilhado entre usuários e entre o Agente 3 e a sua reserva, não com os outros agentes.
+# (desligado com cassetes: um acerto pularia a gravação ou a reprodução do Agente 3)
+CACHE_BUSCA_ATIVO = os.environ.get("CACHE_BUSCA_ATIVO", "1") != "0" and not MODO_CASSETE
+CACHE_BUSCA_TTL = int(os.environ.get("CACHE_BUSCA_TTL", str(24 * 3600)))
+CACHE_BUSCA_MAX_ENTRADAS = int(os.environ.get("CACHE_BUSCA_MAX_ENTRADAS", "500"))
+
+# --- Hedge do Agente 3 (MODELO_ROBUSTO) ---
+# Se o modelo principal não produzir o primeiro evento dentro do percentil HEDGE_PERCENTIL dos tempos
+# já observados, dispara uma chamada reserva no MODELO_RAPIDO; vence o primeiro resultado válido.
+# Erros (inclusive limite de taxa) ou respostas inválidas do principal também acionam a reserva.
+# (desligado com cassetes: o vencedor dependeria do relógio e de qual chamada chegou a gravar o seu cassete)
+HEDGE_ATIVO = os.environ.get("HEDGE_ATIVO", "1") != "0" and not MODO_CASSETE
+HEDGE_PERCENTIL = float(os.environ.get("HEDGE_PERCENTIL", "0.9"))
+HEDGE_ATRASO_PADRAO_S = float(os.environ.get("HEDGE_ATRASO_PADRAO_S", "20")) # Usado até haver amostras suficientes
+HEDGE_AMOSTRAS_MINIMAS = 5
+HEDGE_JANELA = 50 # Tempos até o primeiro evento considerados no percentil
+HEDGE_MAX_EXECUCOES = 1000 # Execuções guardadas para o resumo
+
 # --- Configuração da API Key ---
 # Use st.secrets para obter a chave API de forma segura no Streamlit
 # No Streamlit Cloud, adicione [secrets] GOOGLE_API_KEY="SUA_CHAVE_AQUI"
@@ -23,15 +105,19 @@ warnings.filterwarnings("ignore")
 try:
     os.environ["GOOGLE_API_KEY"] = st.secrets["GOOGLE_API_KEY"]
 except KeyError:
-    st.error("API Key do Google não encontrada. Por favor, configure GOOGLE_API_KEY nos segredos do Streamlit.")
-    st.stop() # Para a execução se a chave não estiver configurada
+    # Na reprodução de cassetes não há chamadas à API, então a chave é dispensável
+    if MODO_CASSETE != "reproduzir":
+        st.error("API Key do Google não encontrada. Por favor, configure GOOGLE_API_KEY nos segredos do Streamlit.")
+        st.stop() # Para a execução se a chave não estiver configurada
 
 # Configura o cliente da SDK do Gemini
 try:
     client = genai.Client()
 except Exception as e:
-    st.error(f"Erro ao inicializar o cliente da API Google GenAI: {e}")
-    st.stop()
+    if MODO_CASSETE != "reproduzir":
+        st.error(f"Erro ao inicializar o cliente da API Google GenAI: {e}")
+        st.stop()
+    client = None # Reprodução de cassetes não precisa do cliente
 
 # Define os modelos a serem usados (conforme o arquivo anexo)
 # Mantendo os modelos especificados, mas Flash é geralmente mais rápido e barato
@@ -44,11 +130,163 @@ MODELO_ROBUSTO = "gemini-1.5-pro-latest"  # Versão Pro como "robusto"
 # Para este caso simples, inicializar aqui é suficiente para a execução única no run_async
 session_service = InMemorySessionService()
 
-# Função auxiliar que envia uma mensagem para um agente via Runner e retorna a resposta final
-# (Adaptada para Streamlit, removendo displays IPython)
-async def call_agent(agent: Agent, message_text: str) -> str:
-    # Usa um ID de sessão baseado no agente para clareza, ou poderia ser fixo para um usuário único
-    session_id = f"{agent.name}_session"
+##########################################
+# --- Métricas e Cache de Prefixo --- #
+##########################################
+# Registro de métricas por chamada ao modelo, compartilhado entre reruns e sessões do Streamlit
+@st.cache_resource
+def obter_metricas() -> RegistroMetricas:
+    return RegistroMetricas(METRICAS_MAX_REGISTROS)
+
+# Backend real: cria o cache de contexto na API do Gemini e o anexa ao pedido
+class BackendCacheGemini:
+    # A API só cria cache para versões fixas do modelo (ex: "gemini-1.5-flash-002"), não para os aliases "-latest"
+    def aceita_modelo(self, modelo) -> bool:
+        return not modelo.endswith("-latest")
+
+    async def criar(self, modelo, instrucao, ferramentas, ttl):
+        cache = await client.aio.caches.create(
+            model=modelo,
+            config=types.CreateCachedContentConfig(
+                system_instruction=instrucao,
+                tools=ferramentas or None,
+                ttl=f"{ttl}s",
+            ),
+        )
+        return cache.name
+
+    async def renovar(self, nome, ttl):
+        await client.aio.caches.update(name=nome, config=types.UpdateCachedContentConfig(ttl=f"{ttl}s"))
+
+    def anexar(self, llm_request: LlmRequest, nome):
+        # Instrução e ferramentas já estão no cache; a API não aceita enviá-las de novo junto com cached_content
+        llm_request.config.cached_content = nome
+        llm_request.config.system_instruction = None
+        llm_request.config.tools = None
+
+@st.cache_resource
+def obter_cache_prefixo() -> CachePrefixo:
+    if CACHE_PREFIXO_BACKEND == "local":
+        # O substituto local aceita qualquer tamanho, para verificar o reuso com as instruções reais
+        return CachePrefixo(BackendCacheLocal(), ttl=CACHE_PREFIXO_TTL, margem=CACHE_PREFIXO_MARGEM)
+    return CachePrefixo(
+        BackendCacheGemini(), ttl=CACHE_PREFIXO_TTL, margem=CACHE_PREFIXO_MARGEM, min_tokens=CACHE_PREFIXO_MIN_TOKENS
+    )
+
+# Resultados validados do Agente 3 por consulta canônica, compartilhados entre reruns e sessões
+@st.cache_resource
+def obter_cache_busca() -> CacheBusca:
+    return CacheBusca(ttl=CACHE_BUSCA_TTL, max_entradas=CACHE_BUSCA_MAX_ENTRADAS)
+
+# Acertos/faltas do cache de busca e latência de cada etapa, para o resumo
+@st.cache_resource
+def obter_metricas_cache_busca() -> RegistroMetricas:
+    return RegistroMetricas(max_registros=METRICAS_MAX_REGISTROS)
+
+# Estado da chamada ao modelo em andamento (início, caches usados), lido no after_model_callback.
+# Fica no contexto da tarefa asyncio de cada agente: não há o que limpar se a chamada falhar ou for cancelada.
+_chamada_atual = contextvars.ContextVar("_chamada_atual", default=None)
+
+# Callback executado antes de cada chamada ao modelo
+async def _antes_do_modelo(callback_context: CallbackContext, llm_request: LlmRequest):
+    chamada = {"inicio": time.perf_counter(), "cache_prefixo": False}
+    _chamada_atual.set(chamada)
+
+    if USAR_CACHE_PREFIXO and llm_request.config and llm_request.config.system_instruction:
+        cache_prefixo = obter_cache_prefixo()
+        instrucao = llm_request.config.system_instruction
+        nome = await cache_prefixo.obter(llm_request.model, instrucao, llm_request.config.tools)
+        if nome is not None:
+            cache_prefixo.backend.anexar(llm_request, nome)
+            chamada["cache_prefixo"] = True
+    # A latência medida é só a da chamada ao modelo, sem a criação/renovação do cache
+    chamada["inicio"] = time.perf_counter()
+    return None # Segue com a chamada normal ao modelo
+
+# Callback executado após cada chamada ao modelo: registra tokens de entrada e latência
+def _depois_do_modelo(callback_context: CallbackContext, llm_response: LlmResponse):
+    chamada = _chamada_atual.get() or {"inicio": time.perf_counter(), "cache_prefixo": False}
+    _chamada_atual.set(None)
+
+    uso = llm_response.usage_metadata
+    latencia_s = round(time.perf_counter() - chamada["inicio"], 3)
+    obter_metricas().registrar({
+        "agente": callback_context.agent_name,
+        "cache_prefixo": chamada["cache_prefixo"],
+        "tokens_entrada": uso.prompt_token_count if uso else None,
+        "tokens_cacheados": uso.cached_content_token_count if uso else None,
+        "tokens_saida": uso.candidates_token_count if uso else None,
+        "latencia_s": latencia_s,
+        "truncado": llm_response.finish_reason == types.FinishReason.MAX_TOKENS,
+    })
+    if ORCAMENTO_ADAPTATIVO and callback_context.agent_name in ORCAMENTOS_AGENTES:
+        obter_orcamento_adaptativo().registrar(callback_context.agent_name, latencia_s)
+    return None
+
+# Escalas adaptativas dos orçamentos, compartilhadas entre reruns e sessões do Streamlit
+@st.cache_resource
+def obter_orcamento_adaptativo() -> OrcamentoAdaptativo:
+    return OrcamentoAdaptativo(
+        LATENCIA_ALVO_P95_S, ORCAMENTO_FATOR_AJUSTE, ORCAMENTO_ESCALA_MINIMA, ORCAMENTO_CHAMADAS_ENTRE_AJUSTES
+    )
+
+# Orçamento efetivo de um agente, já com a escala adaptativa aplicada
+def orcamento_agente(nome_agente: str) -> dict:
+    base = ORCAMENTOS_AGENTES[nome_agente]
+    escala = obter_orcamento_adaptativo().escala(nome_agente)
+    return {
+        "max_tokens": int(base["max_tokens"] * escala),
+        "palavras_por_secao": int(base["palavras_por_secao"] * escala),
+    }
+
+# Cria um Agent já com os callbacks de cache e métricas e o limite de saída do seu orçamento
+def criar_agente(**kwargs) -> Agent:
+    return Agent(
+        before_model_callback=_antes_do_modelo,
+        after_model_callback=_depois_do_modelo,
+        generate_content_config=types.GenerateContentConfig(
+            max_output_tokens=orcamento_agente(kwargs["name"])["max_tokens"],
+        ),
+        **kwargs,
+    )
+
+# Resume as métricas por agente, com e sem cache de prefixo (inclui p95 e taxa de truncamento)
+def resumo_metricas() -> pd.DataFrame:
+    metricas = pd.DataFrame(obter_metricas().listar())
+    if metricas.empty:
+        return metricas
+    return metricas.groupby(["agente", "cache_prefixo"]).agg(
+        chamadas=("latencia_s", "size"),
+        tokens_entrada_medio=("tokens_entrada", "mean"),
+        tokens_cacheados_medio=("tokens_cacheados", "mean"),
+        latencia_media_s=("latencia_s", "mean"),
+        latencia_p95_s=("latencia_s", lambda x: x.quantile(0.95)),
+        taxa_truncamento=("truncado", "mean"),
+    ).reset_index()
+
+# Resume o cache de busca por etapa: taxa de acerto e tempo economizado frente às execuções sem acerto
+def resumo_cache_busca() -> pd.DataFrame:
+    metricas = pd.DataFrame(obter_metricas_cache_busca().listar())
+    if metricas.empty:
+        return metricas
+    linhas = []
+    for etapa, grupo in metricas.groupby("etapa"):
+        acertos = grupo[grupo["cache_busca"] == "acerto"]
+        faltas = grupo[grupo["cache_busca"] == "falta"]
+        economia = 0.0
+        if not acertos.empty and not faltas.empty:
+            economia = len(acertos) * (faltas["latencia_s"].mean() - acertos["latencia_s"].mean())
+        linhas.append({
+            "etapa": etapa,
+            "acertos": len(acertos),
+            "faltas": len(faltas),
+            "taxa_acerto": len(acertos) / len(grupo),
+            "tempo_economizado_s": round(economia, 3),
+        })
+    return pd.DataFrame(linhas)
+
+# Gera os eventos de uma execução ao vivo do agente (mesma sequência de runner.run_async)
+async def _eventos_do_agente(agent: Agent, message_text: str):
     user_id = "streamlit_user" # ID de usuário fixo para a sessão do Streamlit
 
     try:
@@ -77,10 +315,34 @@ async def call_agent(agent: Agent, message_text: str) -> str:
     runner = Runner(agent=agent, app_name=agent.name, session_service=session_service)
     content = types.Content(role="user", parts=[types.Part(text=message_text)])
 
+    async for event in runner.run_async(user_id=user_id, session_id=session.id, new_message=content):
+        yield event
+
+    # Limpar a sessão após o uso, se desejado para evitar acúmulo em InMemorySessionService
+    # await session_service.delete_session(user_id=user_id, session_id=session.id)
+    # Nota: Deletar a sessão pode ser problemático se a mesma sessão ID for usada por múltiplas chamadas
+    # O ideal é que cada sequência de agente use um session_id único ou gerencie-o via st.session_state
+
+# Função auxiliar que envia uma mensagem para um agente via Runner e retorna a resposta final
+# (Adaptada para Streamlit, removendo displays IPython)
+# primeiro_evento (asyncio.Event opcional) é sinalizado assim que o agente produz o primeiro evento
+async def call_agent(agent: Agent, message_text: str, primeiro_evento=None) -> str:
+    caminho = caminho_cassete(PASTA_CASSETES, agent.name, agent.model, agent.instruction, message_text)
+    if MODO_CASSETE == "reproduzir":
+        eventos = reproduzir_cassete(caminho, Event, VELOCIDADE_CASSETE)
+    else:
+        eventos = _eventos_do_agente(agent, message_text)
+
     final_response = ""
+    eventos_gravados = []
+    inicio = time.perf_counter()
     # Use st.empty() or a dedicated area to show progress if needed
     # For simplicity, we just collect the final response here
-    async for event in runner.run_async(user_id=user_id, session_id=session.id, new_message=content):
+    async for event in eventos:
+        if primeiro_evento is not None:
+            primeiro_evento.set()
+        if MODO_CASSETE == "gravar":
+            eventos_gravados.append((time.perf_counter() - inicio, event))
         if event.is_final_response():
           for part in event.content.parts:
             if part.text is not None:
@@ -89,13 +351,53 @@ async def call_agent(agent: Agent, message_text: str) -> str:
               if not final_response.endswith('\n'):
                   final_response += "\n"
 
-    # Limpar a sessão após o uso, se desejado para evitar acúmulo em InMemorySessionService
-    # await session_service.delete_session(user_id=user_id, session_id=session.id)
-    # Nota: Deletar a sessão pode ser problemático se a mesma sessão ID for usada por múltiplas chamadas
-    # O ideal é que cada sequência de agente use um session_id único ou gerencie-o via st.session_state
+    if MODO_CASSETE == "gravar":
+        gravar_cassete(
+            PASTA_CASSETES, agent.name, agent.model, agent.instruction, message_text, eventos_gravados, final_response
+        )
 
     return final_response
 
+# Histórico do hedge (tempos até o primeiro evento do principal e resultado de cada execução)
+@st.cache_resource
+def obter_historico_hedge() -> HistoricoHedge:
+    return HistoricoHedge(max_amostras=HEDGE_JANELA, max_execucoes=HEDGE_MAX_EXECUCOES)
+
+# Atraso antes de disparar a reserva: percentil dos tempos até o primeiro evento do principal
+def atraso_hedge() -> float:
+    amostras = obter_historico_hedge().amostras()
+    return calcular_atraso_hedge(amostras, HEDGE_PERCENTIL, HEDGE_ATRASO_PADRAO_S, HEDGE_AMOSTRAS_MINIMAS)
+
+# Chama o agente principal e, se ele demorar, falhar ou responder algo inválido, também a reserva.
+# Retorna a primeira resposta que passar em validar(texto) e cancela a chamada perdedora.
+async def call_agent_com_hedge(primario: Agent, reserva: Agent, message_text: str, validar) -> str:
+    return await executar_com_hedge(
+        lambda primeiro_evento: call_agent(primario, message_text, primeiro_evento),
+        lambda: call_agent(reserva, message_text),
+        validar,
+        atraso_hedge(),
+        obter_historico_hedge(),
+        rotulos=(primario.model, reserva.model),
+    )
+
+# Resume o hedge: taxa de disparo, vitórias por modelo e p99 do tempo total com hedge versus o do principal.
+# Os dois são medidos do início de cada execução; quando o principal foi cancelado, o tempo dele é um
+# limite inferior, então latencia_p99_primario_min_s subestima o p99 que o principal teria sozinho.
+def resumo_hedge() -> pd.DataFrame:
+    execucoes = pd.DataFrame(obter_historico_hedge().execucoes())
+    if execucoes.empty:
+        return execucoes
+    resumo = {
+        "execucoes": len(execucoes),
+        "taxa_hedge": execucoes["hedge"].mean(),
+        "latencia_p99_com_hedge_s": execucoes["latencia_s"].quantile(0.99),
+        "latencia_p99_primario_min_s": execucoes["primario_s"].quantile(0.99),
+        "fracao_primario_cancelado": execucoes["primario_censurado"].mean(),
+    }
+    for modelo, vitorias in execucoes["vencedor"].value_counts().items():
+        resumo[f"vitorias_{modelo}"] = vitorias
+    return pd.DataFrame([resumo])
+
 # Função auxiliar para formatar texto em Markdown (retorna string)
 def to_markdown_string(text):
   # ADK sometimes returns bullet points as '•'. Convert them to standard markdown '*'
@@ -110,7 +412,8 @@ def to_markdown_string(text):
 async def agente_analisador(data_nascimento):
     # Use st.spinner para mostrar que algo está acontecendo
     with st.spinner("Executando Agente 1: Analisador de Nascimento..."):
-        analisador = Agent(
+        orcamento = orcamento_agente("agente_analisador")
+        analisador = criar_agente(
             name="agente_analisador",
             model=MODELO_RAPIDO,
             instruction="""
@@ -136,6 +439,8 @@ async def agente_analisador(data_nascimento):
         4. **Detector de Auto-Sabotagem:** Com base na data {data_nascimento}, quais são meus hábitos de auto-sabotagem mais prováveis e como eles aparecem no dia a dia? Dê soluções práticas com base na psicologia.
         5. **Mapa de Gatilhos Emocionais:** Usando a data de nascimento {data_nascimento}, explique o que geralmente me desencadeia emocionalmente, como eu costumo reagir e como posso desenvolver resiliência emocional em torno desses padrões.
         6. **Escaneamento de Energia nos Relacionamentos:** Com base na data de nascimento {data_nascimento}, descreva como eu dou e recebo amor, o que preciso de um parceiro e que tipo de pessoa eu naturalmente atraio.
+
+        Limite cada seção a cerca de {orcamento['palavras_por_secao']} palavras.
         """
 
         analises = await call_agent(analisador, entrada_do_agente_analisador)
@@ -146,7 +451,8 @@ async def agente_analisador(data_nascimento):
 ################################################
 async def agente_melhorias(data_nascimento, analises_agente1):
      with st.spinner("Executando Agente 2: Identificador de Melhorias..."):
-        melhorias = Agent(
+        orcamento = orcamento_agente("agente_melhorias")
+        melhorias = criar_agente(
             name="agente_melhorias",
             model=MODELO_RAPIDO,
             instruction="""
@@ -169,6 +475,7 @@ async def agente_melhorias(data_nascimento, analises_agente1):
 
         Com base nas análises acima, para cada uma das seis áreas (Personalidade, Infância, Propósito Profissional, Auto-Sabotagem, Gatilhos Emocionais, Relacionamentos), identifique áreas de melhoria e
         forneça sugestões práticas para o desenvolvimento pessoal. Formate cada seção com um título Markdown (# ou ##).
+        Limite cada seção a cerca de {orcamento['palavras_por_secao']} palavras.
         """
 
         pontos_de_melhoria = await call_agent(melhorias, entrada_do_agente_melhorias)
@@ -177,46 +484,68 @@ async def agente_melhorias(data_nascimento, analises_agente1):
 ######################################
 # --- Agente 3: Buscador de Pessoas de Sucesso --- #
 ######################################
+# Cria o agente buscador; o mesmo papel é usado pelo modelo principal e pela reserva do hedge
+def criar_buscador_sucesso(nome, modelo) -> Agent:
+    return criar_agente(
+        name=nome,
+        model=modelo,
+        instruction="""
+            Você é um pesquisador de pessoas de sucesso brasileiras. Sua tarefa é buscar na internet 5 homens e 5 mulheres
+            que nasceram na data fornecida e que alcançaram sucesso em suas áreas de atuação, e que sejam brasileiros.
+            Ao realizar a busca no Google, certifique-se de incluir o termo "brasileiro" ou "brasileira" e a data completa (dia, mês, ano)
+            para garantir que os resultados sejam apenas de pessoas do Brasil nascidas nessa data.
+            Use a ferramenta de busca do Google (google_search) para encontrar as informações e o site de onde tirou a informação.
+            **Formate sua resposta como uma lista Markdown, onde cada item representa uma pessoa e inclui Nome, Profissão, No que tem sucesso e Site da Informação.**
+            Exemplo:
+            * Nome: [Nome da Pessoa] | Profissão: [Profissão] | Sucesso: [Descrição do Sucesso] | Site: [URL da Fonte]
+            Repita este formato para 5 homens e 5 mulheres.
+            """,
+        description="Agente que busca pessoas de sucesso brasileiras nascidas na mesma data",
+        tools=[google_search]
+    )
+
 # Função adaptada para retornar um DataFrame pandas
 async def agente_buscador_sucesso(data_nascimento):
     with st.spinner("Executando Agente 3: Buscador de Pessoas de Sucesso..."):
-        buscador_sucesso = Agent(
-            name="agente_buscador_sucesso",
-            model=MODELO_ROBUSTO, # Usando modelo mais robusto para busca
-            instruction="""
-                Você é um pesquisador de pessoas de sucesso brasileiras. Sua tarefa é buscar na internet 5 homens e 5 mulheres
-                que nasceram na data fornecida e que alcançaram sucesso em suas áreas de atuação, e que sejam brasileiros.
-                Ao realizar a busca no Google, certifique-se de incluir o termo "brasileiro" ou "brasileira" e a data completa (dia, mês, ano)
-                para garantir que os resultados sejam apenas de pessoas do Brasil nascidas nessa data.
-                Use a ferramenta de busca do Google (google_search) para encontrar as informações e o site de onde tirou a informação.
-                **Formate sua resposta como uma lista Markdown, onde cada item representa uma pessoa e inclui Nome, Profissão, No que tem sucesso e Site da Informação.**
-                Exemplo:
-                * Nome: [Nome da Pessoa] | Profissão: [Profissão] | Sucesso: [Descrição do Sucesso] | Site: [URL da Fonte]
-                Repita este formato para 5 homens e 5 mulheres.
-                """,
-            description="Agente que busca pessoas de sucesso brasileiras nascidas na mesma data",
-            tools=[google_search]
-        )
+        orcamento = orcamento_agente("agente_buscador_sucesso")
+        buscador_sucesso = criar_buscador_sucesso("agente_buscador_sucesso", MODELO_ROBUSTO) # Usando modelo mais robusto para busca
 
         entrada_do_agente_buscador_sucesso = f"""
         Busque na internet 5 homens e 5 mulheres que nasceram na data {data_nascimento} e que alcançaram sucesso
         em suas áreas de atuação, e que sejam brasileiros. Formate a saída como uma lista Markdown
         usando o formato: "* Nome: [Nome] | Profissão: [Profissão] | Sucesso: [Descrição] | Site: [URL]"
+        Descreva o sucesso de cada pessoa em no máximo {orcamento['palavras_por_secao']} palavras.
         """
 
-        tabela_markdown_str = await call_agent(buscador_sucesso, entrada_do_agente_buscador_sucesso)
+        # Num acerto do cache, reaproveita a lista já validada de uma busca anterior para a mesma data
+        inicio = time.perf_counter()
+        consulta_busca = consulta_busca_pessoas_sucesso(data_nascimento)
+        tabela_markdown_str = obter_cache_busca().obter(consulta_busca) if CACHE_BUSCA_ATIVO else None
+        acerto = tabela_markdown_str is not None
+
+        if not acerto and HEDGE_ATIVO:
+            buscador_reserva = criar_buscador_sucesso("agente_buscador_sucesso_reserva", MODELO_RAPIDO)
+            tabela_markdown_str = await call_agent_com_hedge(
+                buscador_sucesso,
+                buscador_reserva,
+                entrada_do_agente_buscador_sucesso,
+                validar=lambda texto: not extrair_pessoas_sucesso(texto).empty,
+            )
+        elif not acerto:
+            tabela_markdown_str = await call_agent(buscador_sucesso, entrada_do_agente_buscador_sucesso)
+
+        if CACHE_BUSCA_ATIVO:
+            # Só guarda respostas que renderam ao menos uma pessoa no formato esperado
+            if not acerto and not extrair_pessoas_sucesso(tabela_markdown_str).empty:
+                obter_cache_busca().guardar(consulta_busca, tabela_markdown_str)
+            obter_metricas_cache_busca().registrar({
+                "etapa": "agente_buscador_sucesso",
+                "cache_busca": "acerto" if acerto else "falta",
+                "latencia_s": round(time.perf_counter() - inicio, 3),
+            })
 
         # --- Parsing da string Markdown para DataFrame ---
-        data = []
-        # A regex busca por linhas que começam com '*' seguido de espaço, e então captura os campos.
-        # Adapte a regex se o formato exato de saída do modelo variar.
-        pattern = re.compile(r"^\*\s*Nome:\s*(.*?)\s*\|\s*Profissão:\s*(.*?)\s*\|\s*Sucesso:\s*(.*?)\s*\|\s*Site:\s*(.*?)\s*$", re.MULTILINE)
-
-        for match in pattern.finditer(tabela_markdown_str):
-            nome, profissao, sucesso, site = match.groups()
-            data.append([nome.strip(), profissao.strip(), sucesso.strip(), site.strip()])
-
-        df = pd.DataFrame(data, columns=["Nome", "Profissão", "Sucesso", "Site da Informação"])
+        df = extrair_pessoas_sucesso(tabela_markdown_str)
 
         return df # Retorna o DataFrame
 
@@ -225,12 +554,13 @@ async def agente_buscador_sucesso(data_nascimento):
 ##########################################
 async def agente_relatorio_final(data_nascimento, analises, melhorias, tabela_sucesso_df):
     with st.spinner("Executando Agente 4: Gerador de Relatório Final..."):
+        orcamento = orcamento_agente("agente_relatorio")
         # Converte o DataFrame da tabela de sucesso para uma string Markdown para incluir no prompt do Agente 4
         # Use to_markdown para um formato legível pelo LLM
         tabela_sucesso_md = tabela_sucesso_df.to_markdown(index=False)
 
 
-        relatorio = Agent(
+        relatorio = criar_agente(
             name="agente_relatorio",
             model=MODELO_RAPIDO,
             instruction="""
@@ -270,6 +600,7 @@ async def agente_relatorio_final(data_nascimento, analises, melhorias, tabela_su
         Inclua todos os detalhes relevantes das seções anteriores.
         Apresente a lista de pessoas de sucesso de forma clara.
         Conclua com uma mensagem de incentivo.
+        Limite cada seção a cerca de {orcamento['palavras_por_secao']} palavras.
         """
 
         relatorio_final = await call_agent(relatorio, entrada_do_agente_relatorio)
@@ -356,6 +687,16 @@ if run_button:
                  report_container.markdown("### Pessoas de Sucesso Nascidas na Mesma Data")
                  report_container.dataframe(st.session_state['sucesso_df'])
 
+            # Métricas de desempenho acumuladas (tokens de entrada e latência, com e sem cache de prefixo)
+            with st.expander("📊 Métricas de desempenho dos agentes"):
+                st.dataframe(resumo_metricas())
+                if HEDGE_ATIVO:
+                    st.markdown("Hedge do Agente 3 (modelo robusto com reserva no modelo rápido):")
+                    st.dataframe(resumo_hedge())
+                if CACHE_BUSCA_ATIVO:
+                    st.markdown("Cache de resultados do google_search por etapa:")
+                    st.dataframe(resumo_cache_busca())
+
 
         except ValueError:
             st.error("Formato de data incorreto. Por favor, use o formato DD/MM/AAAA.")
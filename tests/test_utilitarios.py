@@ -0,0 +1,322 @@
+import asyncio
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel, ConfigDict
+from pydantic.alias_generators import to_camel
+
+from utilitarios import (
+    BackendCacheLocal,
+    CacheBusca,
+    CachePrefixo,
+    HistoricoHedge,
+    OrcamentoAdaptativo,
+    RegistroMetricas,
+    calcular_atraso_hedge,
+    caminho_cassete,
+    consulta_busca_pessoas_sucesso,
+    carregar_cassete,
+    executar_com_hedge,
+    extrair_pessoas_sucesso,
+    gravar_cassete,
+    normalizar_consulta,
+    reproduzir_cassete,
+)
+
+PASTA_CASSETES = os.path.join(os.path.dirname(__file__), "cassetes")
+CASSETE_AGENTE_3 = glob.glob(os.path.join(PASTA_CASSETES, "agente_buscador_sucesso_*.json.gz"))[0]
+
+
+# Evento no mesmo estilo do google.adk.events.Event: pydantic com aliases em camelCase
+class Parte(BaseModel):
+    text: Optional[str] = None
+
+
+class Conteudo(BaseModel):
+    parts: list[Parte]
+    role: str
+
+
+class Evento(BaseModel):
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+    author: str
+    invocation_id: str
+    content: Conteudo
+    error_message: Optional[str] = None
+
+
+def _evento(texto):
+    return Evento(author="agente", invocation_id="inv-1", content=Conteudo(parts=[Parte(text=texto)], role="model"))
+
+
+async def _reproduzir(caminho, velocidade):
+    return [evento async for evento in reproduzir_cassete(caminho, Evento, velocidade)]
+
+
+# --- Cassetes ---
+
+def test_cassete_gravado_e_reproduzido(tmp_path):
+    eventos = [(0.05, _evento("parcial")), (0.1, _evento("final"))]
+    caminho = gravar_cassete(str(tmp_path), "agente", "modelo", "instrução", "mensagem", eventos, "final\n")
+
+    assert caminho == caminho_cassete(str(tmp_path), "agente", "modelo", "instrução", "mensagem")
+    cassete = carregar_cassete(caminho)
+    assert cassete["resposta"] == "final\n"
+    # Campos serializados pelo alias (como o ADK grava) e campos vazios omitidos
+    assert "invocationId" in cassete["eventos"][0]["evento"]
+    assert "errorMessage" not in cassete["eventos"][0]["evento"]
+
+    inicio = time.perf_counter()
+    reproduzidos = asyncio.run(_reproduzir(caminho, velocidade=1))
+    assert time.perf_counter() - inicio >= 0.1 # Respeita o instante gravado do último evento
+    assert reproduzidos == [evento for _, evento in eventos]
+
+
+def test_cassete_reproduzido_sem_esperas(tmp_path):
+    caminho = gravar_cassete(str(tmp_path), "agente", "modelo", "i", "m", [(5.0, _evento("final"))], "final")
+
+    inicio = time.perf_counter()
+    reproduzidos = asyncio.run(_reproduzir(caminho, velocidade=0))
+    assert time.perf_counter() - inicio < 1.0
+    assert reproduzidos[0].content.parts[0].text == "final"
+
+
+def test_cassete_de_outra_mensagem_nao_e_encontrado(tmp_path):
+    gravar_cassete(str(tmp_path), "agente", "modelo", "i", "m", [], "")
+    outro = caminho_cassete(str(tmp_path), "agente", "modelo", "i", "outra mensagem")
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(_reproduzir(outro, velocidade=0))
+
+
+def test_cassete_do_agente_3_tem_a_chave_do_pedido_gravado():
+    cassete = carregar_cassete(CASSETE_AGENTE_3)
+    assert CASSETE_AGENTE_3 == caminho_cassete(
+        PASTA_CASSETES, cassete["agente"], cassete["modelo"], cassete["instrucao"], cassete["mensagem"]
+    )
+    reproduzidos = asyncio.run(_reproduzir(CASSETE_AGENTE_3, velocidade=0))
+    assert reproduzidos[-1].content.parts[0].text == cassete["resposta"]
+
+
+# --- Parser do Agente 3 ---
+
+def test_extrair_pessoas_sucesso_do_cassete():
+    df = extrair_pessoas_sucesso(carregar_cassete(CASSETE_AGENTE_3)["resposta"])
+
+    assert list(df.columns) == ["Nome", "Profissão", "Sucesso", "Site da Informação"]
+    # A linha sem "Site" e os textos livres não entram na tabela
+    assert len(df) == 4
+    assert df.iloc[1]["Nome"] == "Pessoa Exemplo Dois"
+    assert df.iloc[1]["Site da Informação"] == "https://www.exemplo.org/musica"
+    assert df.iloc[2]["Profissão"] == "Atleta"
+
+
+def test_extrair_pessoas_sucesso_sem_itens():
+    assert extrair_pessoas_sucesso("Não encontrei resultados.").empty
+
+
+# --- Métricas ---
+
+def test_registro_metricas_descarta_as_mais_antigas():
+    registro = RegistroMetricas(max_registros=3)
+    for i in range(5):
+        registro.registrar({"agente": "a" if i % 2 == 0 else "b", "latencia_s": i})
+
+    assert [m["latencia_s"] for m in registro.listar()] == [2, 3, 4]
+    assert [m["latencia_s"] for m in registro.listar("a")] == [2, 4]
+
+
+# --- Cache de prefixo ---
+
+def _pedido(instrucao, ferramentas=None):
+    return SimpleNamespace(config=SimpleNamespace(system_instruction=instrucao, tools=ferramentas))
+
+
+def test_cache_prefixo_cria_uma_vez_e_reutiliza():
+    backend = BackendCacheLocal()
+    cache = CachePrefixo(backend, ttl=3600, margem=300)
+
+    for _ in range(3):
+        pedido = _pedido("instrução fixa", ["google_search"])
+        nome = asyncio.run(cache.obter("modelo", "instrução fixa", pedido.config.tools))
+        backend.anexar(pedido, nome)
+    outro = asyncio.run(cache.obter("modelo", "outra instrução", None))
+
+    assert outro != nome
+    assert backend.criacoes == 2
+    assert backend.reusos == {nome: 3}
+
+
+def test_backend_local_recusa_prefixo_diferente_do_cacheado():
+    backend = BackendCacheLocal()
+    cache = CachePrefixo(backend, ttl=3600, margem=300)
+    nome = asyncio.run(cache.obter("modelo", "instrução fixa", ["google_search"]))
+
+    # O pedido enviado perdeu a ferramenta: não é o mesmo prefixo que foi cacheado
+    with pytest.raises(RuntimeError):
+        backend.anexar(_pedido("instrução fixa"), nome)
+
+
+def test_cache_prefixo_ignora_prefixo_abaixo_do_minimo_e_modelo_nao_aceito():
+    class BackendSoVersionado(BackendCacheLocal):
+        def aceita_modelo(self, modelo):
+            return not modelo.endswith("-latest")
+
+    backend = BackendSoVersionado()
+    cache = CachePrefixo(backend, ttl=3600, margem=300, min_tokens=100)
+
+    assert asyncio.run(cache.obter("modelo-002", "curta", None)) is None
+    assert asyncio.run(cache.obter("modelo-latest", "x" * 400, None)) is None
+    assert asyncio.run(cache.obter("modelo-002", "x" * 400, None)) is not None
+    assert backend.criacoes == 1
+
+
+def test_cache_prefixo_nao_tenta_de_novo_apos_falha():
+    class BackendQueFalha(BackendCacheLocal):
+        async def criar(self, modelo, instrucao, ferramentas, ttl):
+            self.criacoes += 1
+            raise ValueError("recusado pela API")
+
+    backend = BackendQueFalha()
+    cache = CachePrefixo(backend, ttl=3600, margem=300)
+    assert asyncio.run(cache.obter("modelo", "instrução", None)) is None
+    assert asyncio.run(cache.obter("modelo", "instrução", None)) is None
+    assert backend.criacoes == 1
+
+
+# --- Orçamentos ---
+
+def _orcamento():
+    return OrcamentoAdaptativo(alvo_p95_s=30, fator=0.8, escala_minima=0.4, chamadas_entre_ajustes=5)
+
+
+def test_orcamento_ajusta_a_cada_lote_de_chamadas():
+    orcamento = _orcamento()
+    for latencia in [10, 10, 10, 10]:
+        orcamento.registrar("a", latencia)
+    assert orcamento.escala("a") == 1.0 # Ainda não completou o lote
+
+    orcamento.registrar("a", 50) # p95 do lote passa do alvo
+    assert orcamento.escala("a") == pytest.approx(0.8)
+    assert orcamento.escala("b") == 1.0
+
+
+def test_orcamento_nao_reaproveita_amostras_de_ajustes_anteriores():
+    orcamento = _orcamento()
+    for latencia in [60] * 5 + [25] * 5:
+        orcamento.registrar("a", latencia)
+    # O lote lento reduz uma vez; o lote seguinte, dentro da faixa, não reduz de novo
+    assert orcamento.escala("a") == pytest.approx(0.8)
+
+    for _ in range(5):
+        orcamento.registrar("a", 5)
+    assert orcamento.escala("a") == pytest.approx(1.0)
+
+
+def test_orcamento_respeita_escala_minima():
+    orcamento = _orcamento()
+    for _ in range(50):
+        orcamento.registrar("a", 60)
+    assert orcamento.escala("a") == pytest.approx(0.4)
+
+
+def test_orcamento_entre_threads_ajusta_cada_lote_uma_vez():
+    orcamento = OrcamentoAdaptativo(alvo_p95_s=30, fator=0.5, escala_minima=0.0, chamadas_entre_ajustes=5)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: orcamento.registrar("a", 60), range(10)))
+    # Dez amostras são exatamente dois lotes: 1.0 * 0.5 * 0.5
+    assert orcamento.escala("a") == pytest.approx(0.25)
+
+
+# --- Hedge ---
+def _chamada(texto, espera=0.0, erro=None, espera_primeiro_evento=None):
+    async def chamar(primeiro_evento=None):
+        if espera_primeiro_evento is not None:
+            await asyncio.sleep(espera_primeiro_evento)
+            primeiro_evento.set()
+        await asyncio.sleep(espera)
+        if erro is not None:
+            raise erro
+        return texto
+    return chamar
+
+def _hedge(primario, reserva, atraso=0.05, historico=None, validar=lambda texto: texto != "invalido"):
+    historico = historico or HistoricoHedge(max_amostras=10, max_execucoes=10)
+    resposta = asyncio.run(executar_com_hedge(primario, reserva, validar, atraso, historico))
+    return resposta, historico
+
+def test_hedge_primario_rapido_nao_dispara_reserva():
+    reserva_chamada = []
+    async def reserva():
+        reserva_chamada.append(True)
+        return "reserva"
+    resposta, historico = _hedge(_chamada("primario", espera_primeiro_evento=0.0), reserva)
+    assert resposta == "primario" and not reserva_chamada
+    execucao = historico.execucoes()[0]
+    assert not execucao["hedge"] and execucao["vencedor"] == "primario"
+    assert not execucao["primario_censurado"]
+    assert len(historico.amostras()) == 1
+
+def test_hedge_primario_lento_perde_e_fica_censurado():
+    resposta, historico = _hedge(_chamada("primario", espera=1.0), _chamada("reserva"))
+    assert resposta == "reserva"
+    execucao = historico.execucoes()[0]
+    assert execucao["hedge"] and execucao["motivo"] == "atraso" and execucao["vencedor"] == "reserva"
+    # O principal foi cancelado: o seu tempo é só um limite inferior e nenhuma amostra é registrada
+    assert execucao["primario_censurado"]
+    assert execucao["primario_s"] <= execucao["latencia_s"]
+    assert historico.amostras() == []
+
+def test_hedge_erro_ou_invalido_aciona_reserva():
+    resposta, historico = _hedge(_chamada(None, erro=RuntimeError("429")), _chamada("reserva"), atraso=10)
+    assert resposta == "reserva" and historico.execucoes()[0]["motivo"] == "erro"
+    resposta, historico = _hedge(_chamada("invalido"), _chamada("reserva"), atraso=10)
+    assert resposta == "reserva" and historico.execucoes()[0]["motivo"] == "invalido"
+
+def test_hedge_ambos_falham():
+    with pytest.raises(RuntimeError):
+        _hedge(_chamada(None, erro=RuntimeError("429")), _chamada(None, erro=ValueError("x")), atraso=10)
+
+def test_calcular_atraso_hedge():
+    assert calcular_atraso_hedge([1.0, 2.0], 0.9, 8.0, 5) == 8.0
+    assert calcular_atraso_hedge([1.0] * 9 + [11.0], 0.5, 8.0, 5) == 1.0
+
+def test_historico_hedge_limitado():
+    historico = HistoricoHedge(max_amostras=3, max_execucoes=2)
+    for i in range(5):
+        historico.registrar_primeiro_evento(float(i))
+        historico.registrar_execucao({"i": i})
+    assert historico.amostras() == [2.0, 3.0, 4.0]
+    assert [e["i"] for e in historico.execucoes()] == [3, 4]
+
+
+# --- Cache de busca ---
+def test_consulta_busca_canonica_e_normalizada():
+    consulta = consulta_busca_pessoas_sucesso("05/03/1990")
+    assert consulta == "pessoas de sucesso brasileiras nascidas em 5 de março de 1990"
+    assert normalizar_consulta(consulta) == normalizar_consulta("Pessoas de  SUCESSO brasileiras, nascidas em 5 de Marco de 1990!")
+
+def test_cache_busca_lru_e_ttl(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: agora[0])
+    cache = CacheBusca(ttl=60, max_entradas=2)
+    cache.guardar("a", "tabela a")
+    cache.guardar("b", "tabela b")
+    assert cache.obter("A!") == "tabela a" # "a" passa a ser a mais recente
+    cache.guardar("c", "tabela c")
+    assert cache.obter("b") is None and cache.obter("c") == "tabela c"
+    agora[0] += 61
+    assert cache.obter("a") is None and cache.obter("c") is None
+
+def test_cache_busca_threads():
+    cache = CacheBusca(ttl=60, max_entradas=10)
+    def usar(i):
+        cache.guardar(f"consulta {i % 20}", i)
+        cache.obter(f"consulta {(i + 1) % 20}")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(usar, range(2000)))
+    assert len(cache.entradas) == 10
@@ -0,0 +1,356 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import pandas as pd
+
+# Funções e classes sem dependência do Streamlit ou do ADK, usadas pelo app.py
+# (separadas aqui para poderem ser testadas sem rede e sem chave de API)
+
+##########################################
+# --- Cassetes de Gravação/Reprodução --- #
+##########################################
+# Caminho do cassete de uma chamada: identifica agente, modelo, instrução e mensagem enviada
+def caminho_cassete(pasta: str, agente: str, modelo: str, instrucao: str, mensagem: str) -> str:
+    chave = json.dumps([agente, modelo, instrucao, mensagem], ensure_ascii=False)
+    resumo = hashlib.sha256(chave.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(pasta, f"{agente}_{resumo}.json.gz")
+
+# Grava um cassete compacto (JSON compactado com gzip) com pedido, eventos e resposta final.
+# eventos_gravados é uma lista de (instante em segundos desde o início da chamada, evento pydantic).
+def gravar_cassete(pasta: str, agente: str, modelo: str, instrucao: str, mensagem: str, eventos_gravados, resposta: str) -> str:
+    os.makedirs(pasta, exist_ok=True)
+    cassete = {
+        "agente": agente,
+        "modelo": modelo,
+        "instrucao": instrucao,
+        "mensagem": mensagem,
+        "eventos": [
+            {"t": round(t, 4), "evento": evento.model_dump(mode="json", exclude_none=True, by_alias=True)}
+            for t, evento in eventos_gravados
+        ],
+        "resposta": resposta,
+    }
+    caminho = caminho_cassete(pasta, agente, modelo, instrucao, mensagem)
+    with gzip.open(caminho, "wt", encoding="utf-8") as f:
+        json.dump(cassete, f, ensure_ascii=False, separators=(",", ":"))
+    return caminho
+
+# Lê um cassete do disco (útil também para testar os parsers com saídas reais gravadas)
+def carregar_cassete(caminho: str) -> dict:
+    with gzip.open(caminho, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+# Reproduz a sequência de eventos gravada como objetos de classe_evento (ex: google.adk.events.Event),
+# no ritmo original (velocidade=1), acelerado (velocidade > 1) ou sem esperas (velocidade=0)
+async def reproduzir_cassete(caminho: str, classe_evento, velocidade: float = 1.0):
+    if not os.path.exists(caminho):
+        raise FileNotFoundError(f"Cassete não encontrado: {caminho}. Grave-o com MODO_CASSETE=gravar.")
+    cassete = carregar_cassete(caminho)
+
+    inicio = time.perf_counter()
+    for item in cassete["eventos"]:
+        if velocidade > 0:
+            espera = item["t"] / velocidade - (time.perf_counter() - inicio)
+            if espera > 0:
+                await asyncio.sleep(espera)
+        yield classe_evento.model_validate(item["evento"])
+
+##########################################
+# --- Parser do Agente 3 --- #
+##########################################
+# Converte a lista Markdown do Agente 3 em DataFrame (separado para poder ser testado com cassetes gravados)
+def extrair_pessoas_sucesso(tabela_markdown_str: str) -> pd.DataFrame:
+    data = []
+    # A regex busca por linhas que começam com '*' seguido de espaço, e então captura os campos.
+    # Adapte a regex se o formato exato de saída do modelo variar.
+    pattern = re.compile(r"^\*\s*Nome:\s*(.*?)\s*\|\s*Profissão:\s*(.*?)\s*\|\s*Sucesso:\s*(.*?)\s*\|\s*Site:\s*(.*?)\s*$", re.MULTILINE)
+
+    for match in pattern.finditer(tabela_markdown_str):
+        nome, profissao, sucesso, site = match.groups()
+        data.append([nome.strip(), profissao.strip(), sucesso.strip(), site.strip()])
+
+    return pd.DataFrame(data, columns=["Nome", "Profissão", "Sucesso", "Site da Informação"])
+
+##########################################
+# --- Métricas --- #
+##########################################
+# Registro limitado das métricas por chamada ao modelo, seguro para as várias sessões (threads) do Streamlit
+class RegistroMetricas:
+    def __init__(self, max_registros):
+        self.registros = deque(maxlen=max_registros)
+        self.lock = threading.Lock()
+
+    def registrar(self, metrica: dict):
+        with self.lock:
+            self.registros.append(metrica)
+
+    # Cópia dos registros (opcionalmente só de um agente), para ser lida fora do lock
+    def listar(self, agente=None) -> list:
+        with self.lock:
+            return [m for m in self.registros if agente is None or m["agente"] == agente]
+
+##########################################
+# --- Orçamentos de Geração --- #
+##########################################
+# Escala adaptativa do orçamento de cada agente (1.0 = orçamento base), compartilhada entre as sessões.
+# A cada `chamadas_entre_ajustes` latências de um agente, calcula o p95 só dessas amostras: reduz a escala
+# se passou do alvo, relaxa se ficou abaixo de 70% dele. O lock impede que duas threads ajustem o mesmo lote.
+class OrcamentoAdaptativo:
+    def __init__(self, alvo_p95_s, fator, escala_minima, chamadas_entre_ajustes):
+        self.alvo_p95_s = alvo_p95_s
+        self.fator = fator
+        self.escala_minima = escala_minima
+        self.chamadas_entre_ajustes = chamadas_entre_ajustes
+        self.estados = {} # agente -> {"escala", "latencias" desde o último ajuste}
+        self.lock = threading.Lock()
+
+    def escala(self, agente) -> float:
+        with self.lock:
+            return self.estados.get(agente, {}).get("escala", 1.0)
+
+    def registrar(self, agente, latencia_s):
+        with self.lock:
+            estado = self.estados.setdefault(agente, {"escala": 1.0, "latencias": []})
+            estado["latencias"].append(latencia_s)
+            # Espera algumas chamadas com o orçamento atual antes de ajustar de novo
+            if len(estado["latencias"]) < self.chamadas_entre_ajustes:
+                return
+
+            p95 = pd.Series(estado["latencias"]).quantile(0.95)
+            if p95 > self.alvo_p95_s:
+                estado["escala"] = max(self.escala_minima, estado["escala"] * self.fator)
+            elif p95 < self.alvo_p95_s * 0.7:
+                estado["escala"] = min(1.0, estado["escala"] / self.fator)
+            # Amostras usadas num ajuste não contam no próximo
+            estado["latencias"] = []
+
+##########################################
+# --- Cache de Prefixo --- #
+##########################################
+# Forma estável de comparar as ferramentas de dois pedidos
+def serializar_ferramentas(ferramentas) -> list:
+    return [str(f) for f in ferramentas or []]
+
+# Substituto local: não chama a API nem altera o pedido; confere que o prefixo que será enviado
+# (instrução de sistema e ferramentas) é exatamente o que foi registrado quando o "cache" foi criado
+class BackendCacheLocal:
+    def __init__(self):
+        self.prefixos = {}
+        self.criacoes = 0
+        self.reusos = {} # nome do cache -> vezes que foi anexado
+
+    def aceita_modelo(self, modelo) -> bool:
+        return True
+
+    async def criar(self, modelo, instrucao, ferramentas, ttl):
+        nome = f"local/{modelo}/{len(self.prefixos)}"
+        self.prefixos[nome] = (instrucao, serializar_ferramentas(ferramentas))
+        self.criacoes += 1
+        return nome
+
+    async def renovar(self, nome, ttl):
+        pass
+
+    def anexar(self, llm_request, nome):
+        enviado = (llm_request.config.system_instruction, serializar_ferramentas(llm_request.config.tools))
+        if self.prefixos.get(nome) != enviado:
+            raise RuntimeError(f"Prefixo enviado difere do registrado no cache {nome}")
+        self.reusos[nome] = self.reusos.get(nome, 0) + 1
+
+# Mantém um cache por (modelo, instrução, ferramentas): cria uma vez, reutiliza e renova antes de expirar.
+# Prefixos com menos de min_tokens (estimados) ou modelos que o backend não aceita nem chegam à API.
+class CachePrefixo:
+    def __init__(self, backend, ttl, margem, min_tokens=0):
+        self.backend = backend
+        self.ttl = ttl
+        self.margem = margem
+        self.min_tokens = min_tokens
+        self.entradas = {} # chave -> (nome do cache ou None se não elegível, expira_em)
+
+    async def obter(self, modelo, instrucao, ferramentas):
+        # Estimativa grosseira de ~4 caracteres por token
+        if len(instrucao) // 4 < self.min_tokens or not self.backend.aceita_modelo(modelo):
+            return None
+        chave = hashlib.sha256(
+            json.dumps([modelo, instrucao, serializar_ferramentas(ferramentas)], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        agora = time.time()
+        nome, expira_em = self.entradas.get(chave, (None, 0))
+
+        if expira_em - agora > self.margem:
+            return nome
+        if nome is not None and expira_em > agora:
+            try:
+                await self.backend.renovar(nome, self.ttl)
+                self.entradas[chave] = (nome, agora + self.ttl)
+                return nome
+            except Exception:
+                pass # Se a renovação falhar, tenta criar um novo cache
+
+        try:
+            nome = await self.backend.criar(modelo, instrucao, ferramentas, self.ttl)
+        except Exception:
+            # Ex: prefixo recusado pela API; evita tentar de novo até o TTL
+            nome = None
+        self.entradas[chave] = (nome, agora + self.ttl)
+        return nome
+
+##########################################
+# --- Hedge --- #
+##########################################
+# Histórico do hedge compartilhado entre as sessões: últimos tempos até o primeiro evento do principal
+# (só os observados) e últimas execuções, em deques limitadas protegidas por lock
+class HistoricoHedge:
+    def __init__(self, max_amostras, max_execucoes):
+        self.primeiro_evento_s = deque(maxlen=max_amostras)
+        self.execucoes_registradas = deque(maxlen=max_execucoes)
+        self.lock = threading.Lock()
+
+    def registrar_primeiro_evento(self, segundos: float):
+        with self.lock:
+            self.primeiro_evento_s.append(segundos)
+
+    def amostras(self) -> list:
+        with self.lock:
+            return list(self.primeiro_evento_s)
+
+    def registrar_execucao(self, execucao: dict):
+        with self.lock:
+            self.execucoes_registradas.append(execucao)
+
+    def execucoes(self) -> list:
+        with self.lock:
+            return list(self.execucoes_registradas)
+
+# Atraso antes de disparar a reserva: percentil dos tempos até o primeiro evento do principal
+def calcular_atraso_hedge(amostras, percentil, padrao, amostras_minimas) -> float:
+    if len(amostras) < amostras_minimas:
+        return padrao
+    return float(pd.Series(amostras).quantile(percentil))
+
+# Chama o principal e, se ele demorar mais que `atraso`, falhar ou responder algo inválido, também a reserva.
+# chamar_primario(primeiro_evento) e chamar_reserva() devolvem corrotinas que retornam o texto da resposta.
+# Retorna a primeira resposta que passar em validar(texto) e cancela a chamada perdedora.
+async def executar_com_hedge(chamar_primario, chamar_reserva, validar, atraso, historico: HistoricoHedge, rotulos=("primario", "reserva")) -> str:
+    inicio = time.perf_counter()
+    primario, reserva = rotulos
+
+    primeiro_evento = asyncio.Event()
+    tarefa_primaria = asyncio.create_task(chamar_primario(primeiro_evento))
+    tarefas = {tarefa_primaria: primario}
+    # Tempo total do principal (fim normal, erro ou cancelamento), para comparar com o tempo total da execução
+    fim_primario = []
+    tarefa_primaria.add_done_callback(lambda _: fim_primario.append(time.perf_counter() - inicio))
+
+    # Registra o tempo até o primeiro evento do principal sempre que ele ocorrer, mesmo depois do hedge.
+    # Só entram no histórico tempos realmente observados; se o principal for cancelado antes, nada é registrado.
+    async def observar_primeiro_evento():
+        await primeiro_evento.wait()
+        historico.registrar_primeiro_evento(time.perf_counter() - inicio)
+
+    observador = asyncio.create_task(observar_primeiro_evento())
+    await asyncio.wait({observador, tarefa_primaria}, timeout=atraso, return_when=asyncio.FIRST_COMPLETED)
+
+    motivo = None
+    if not primeiro_evento.is_set() and not tarefa_primaria.done():
+        motivo = "atraso"
+        tarefas[asyncio.create_task(chamar_reserva())] = reserva
+
+    resposta, vencedor, erro = None, None, None
+    pendentes = set(tarefas)
+    while pendentes and vencedor is None:
+        feitas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+        for tarefa in feitas:
+            rotulo = tarefas[tarefa]
+            if tarefa.exception() is None:
+                texto = tarefa.result()
+                if validar(texto):
+                    resposta, vencedor = texto, rotulo
+                    break
+                if resposta is None:
+                    resposta = texto # Guarda a resposta inválida caso nenhuma seja válida
+            elif erro is None:
+                erro = tarefa.exception()
+            # Fallback: o principal falhou (erro, limite de taxa) ou respondeu algo inválido
+            if tarefa is tarefa_primaria and len(tarefas) == 1:
+                motivo = "erro" if tarefa.exception() is not None else "invalido"
+                tarefa_reserva = asyncio.create_task(chamar_reserva())
+                tarefas[tarefa_reserva] = reserva
+                pendentes.add(tarefa_reserva)
+
+    # Cancela a chamada perdedora
+    for tarefa in pendentes:
+        tarefa.cancel()
+    await asyncio.gather(*pendentes, return_exceptions=True)
+    # Com o evento já sinalizado o observador termina de imediato; senão não há amostra a registrar
+    if primeiro_evento.is_set():
+        await observador
+    else:
+        observador.cancel()
+        await asyncio.gather(observador, return_exceptions=True)
+
+    historico.registrar_execucao({
+        "hedge": len(tarefas) > 1,
+        "motivo": motivo,
+        "vencedor": vencedor,
+        "latencia_s": round(time.perf_counter() - inicio, 3),
+        # Se o principal foi cancelado, primario_s é só um limite inferior do tempo que ele levaria
+        "primario_s": round(fim_primario[0], 3),
+        "primario_censurado": tarefa_primaria.cancelled(),
+    })
+
+    if vencedor is None and resposta is None:
+        raise erro
+    return resposta
+
+##########################################
+# --- Cache de Busca --- #
+##########################################
+MESES = ["janeiro", "fevereiro", "março", "abril", "maio", "junho",
+         "julho", "agosto", "setembro", "outubro", "novembro", "dezembro"]
+
+# Consulta canônica da busca de pessoas de sucesso (Agente 3) para uma data DD/MM/AAAA
+def consulta_busca_pessoas_sucesso(data_nascimento: str) -> str:
+    data_objeto = datetime.strptime(data_nascimento, '%d/%m/%Y')
+    return f"pessoas de sucesso brasileiras nascidas em {data_objeto.day} de {MESES[data_objeto.month - 1]} de {data_objeto.year}"
+
+# Normaliza o texto da consulta: minúsculas, sem acentos, sem pontuação e com espaços simples
+def normalizar_consulta(consulta: str) -> str:
+    texto = unicodedata.normalize("NFKD", consulta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]", " ", texto).split())
+
+# Cache LRU com TTL por consulta normalizada, protegido por lock (compartilhado entre sessões)
+class CacheBusca:
+    def __init__(self, ttl, max_entradas):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.entradas = OrderedDict() # consulta normalizada -> (valor, expira_em)
+        self.lock = threading.Lock()
+
+    def obter(self, consulta: str):
+        chave = normalizar_consulta(consulta)
+        with self.lock:
+            valor, expira_em = self.entradas.get(chave, (None, 0))
+            if valor is None or expira_em < time.time():
+                self.entradas.pop(chave, None)
+                return None
+            self.entradas.move_to_end(chave)
+            return valor
+
+    def guardar(self, consulta: str, valor):
+        chave = normalizar_consulta(consulta)
+        with self.lock:
+            self.entradas[chave] = (valor, time.time() + self.ttl)
+            self.entradas.move_to_end(chave)
+            while len(self.entradas) > self.max_entradas:
+                self.entradas.popitem(last=False)